@@ -0,0 +1,155 @@
+"""
+Listening socket handoff
+Lets a newly started instance take over the bound sockets of a running one
+over a Unix socket (SCM_RIGHTS), so the port never refuses connections.
+"""
+
+import array
+import os
+import socket
+import threading
+
+HANDOFF_SUPPORTED = hasattr(socket, 'AF_UNIX') and hasattr(socket, 'SCM_RIGHTS')
+
+HANDOFF_MAGIC = b'MCSH'
+HANDOFF_ACK = b'OK'
+HANDOFF_TIMEOUT = 5.0
+MAX_HANDOFF_FDS = 2
+MAX_HANDOFF_STATE = 64
+
+
+class HandoffError(Exception):
+    """Exception raised when a socket handoff fails"""
+    pass
+
+
+def request_sockets(path):
+    """Ask a running instance for its sockets.
+
+    Returns the handoff connection, the received file descriptors
+    (listening socket first, then the query socket if any) and the state
+    sent along with them, or (None, None, None) when no instance is
+    listening. The connection must be passed to finish_request once the
+    new instance is accepting.
+    """
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.settimeout(HANDOFF_TIMEOUT)
+    try:
+        conn.connect(path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        conn.close()
+        return None, None, None
+
+    try:
+        fd_size = array.array('i').itemsize
+        message, ancdata, flags, _ = conn.recvmsg(len(HANDOFF_MAGIC) + 1 + MAX_HANDOFF_STATE, socket.CMSG_SPACE(MAX_HANDOFF_FDS * fd_size))
+    except OSError as e:
+        conn.close()
+        raise HandoffError(f"Failed to receive sockets: {e}")
+
+    fds = array.array('i')
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(data[:len(data) - (len(data) % fd_size)])
+
+    if not message.startswith(HANDOFF_MAGIC) or len(fds) == 0 or flags & socket.MSG_CTRUNC:
+        for fd in fds:
+            os.close(fd)
+        conn.close()
+        raise HandoffError("Invalid handoff message")
+
+    return conn, list(fds), message[len(HANDOFF_MAGIC) + 1:]
+
+
+def finish_request(conn):
+    """Tell the old instance to stop accepting and wait for it to let go"""
+    try:
+        conn.sendall(HANDOFF_ACK)
+        conn.settimeout(HANDOFF_TIMEOUT)
+        # The old instance closes the connection once its handoff
+        # listener is closed, so the path can then be reused.
+        conn.recv(1)
+    except OSError:
+        pass
+    finally:
+        conn.close()
+
+
+class HandoffListener:
+    """Hands the given sockets to the next instance that connects.
+
+    on_prepare is called before sending and returns the state to send
+    along (at most MAX_HANDOFF_STATE bytes), on_abort undoes it if the
+    handoff fails, and on_handoff is called once the new instance took over.
+    """
+
+    def __init__(self, path, sockets, on_handoff, on_prepare=None, on_abort=None):
+        self.path = path
+        self.sockets = sockets
+        self.on_handoff = on_handoff
+        self.on_prepare = on_prepare
+        self.on_abort = on_abort
+        self.handed_off = False
+
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(path)
+        self.listener.listen(1)
+
+    def start(self):
+        thread = threading.Thread(target=self._serve)
+        thread.daemon = True
+        thread.start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                break
+
+            try:
+                if self._hand_off(conn):
+                    break
+            finally:
+                if self.handed_off:
+                    self.listener.close()
+                conn.close()
+
+    def _hand_off(self, conn):
+        conn.settimeout(HANDOFF_TIMEOUT)
+        fds = array.array('i', [sock.fileno() for sock in self.sockets])
+        state = self.on_prepare() if self.on_prepare is not None else b''
+        try:
+            conn.sendmsg([HANDOFF_MAGIC + bytes([len(fds)]) + state], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, fds)])
+            ack = conn.recv(len(HANDOFF_ACK))
+        except OSError as e:
+            print(f"[WARN] Socket handoff failed: {e}")
+            ack = None
+
+        if ack != HANDOFF_ACK:
+            if ack is not None:
+                print("[WARN] Socket handoff aborted by the new instance")
+            if self.on_abort is not None:
+                self.on_abort()
+            return False
+
+        self.handed_off = True
+        print("[INFO] Sockets handed off to the new instance")
+        self.on_handoff()
+        return True
+
+    def close(self):
+        try:
+            self.listener.close()
+        except OSError:
+            pass
+        if not self.handed_off:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
@@ -0,0 +1,204 @@
+"""
+UDP Query protocol (GameSpy4) responder
+Answers handshake, basic stat and full stat requests so monitoring tools
+see the holder as a live server.
+"""
+
+import hashlib
+import hmac
+import os
+import socket
+import struct
+import threading
+import time
+
+MAGIC = b'\xfe\xfd'
+TYPE_HANDSHAKE = 0x09
+TYPE_STAT = 0x00
+
+# Challenge tokens are derived from a rotating secret, a token stays valid
+# for between one and two lifetimes.
+TOKEN_LIFETIME = 30.0
+
+HANDSHAKE_REQUEST_LENGTH = 7
+BASIC_STAT_REQUEST_LENGTH = 11
+FULL_STAT_REQUEST_LENGTH = 15
+
+SECRETS_LENGTH = 32
+
+
+def create_query_socket(host, port):
+    """Create and bind the UDP socket used by the query responder"""
+    query_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    query_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    query_socket.bind((host, port))
+    return query_socket
+
+
+class QueryServer:
+    """Stateless GameSpy4 responder serving prebuilt stat payloads"""
+
+    def __init__(self, sock, motd, version, max_players, host_ip, host_port, rate_limit=50, poll_interval=None, secrets=None):
+        self.sock = sock
+        self.rate_limit = max(1, int(rate_limit))
+        self._stopped = threading.Event()
+        self._thread = None
+
+        # A blocking recvfrom cannot be interrupted, so a responder that may
+        # be stopped polls instead.
+        if poll_interval is not None:
+            self.sock.settimeout(poll_interval)
+
+        self._basic_response = self._build_basic_response(motd, max_players, host_ip, host_port)
+        self._full_response = self._build_full_response(motd, version, max_players, host_ip, host_port)
+
+        if secrets is not None and len(secrets) == SECRETS_LENGTH:
+            # Taken over from a previous instance, so tokens it issued stay valid
+            self._secret, self._previous_secret = secrets[:16], secrets[16:]
+        else:
+            self._secret = os.urandom(16)
+            self._previous_secret = self._secret
+        self._rotated_at = time.monotonic()
+
+        self._allowance = float(self.rate_limit)
+        self._last_refill = time.monotonic()
+
+    @staticmethod
+    def _build_basic_response(motd, max_players, host_ip, host_port):
+        payload = bytearray(b'\x00' + b'\x00' * 4)
+        for value in (motd, 'SMP', 'world', '0', str(max_players)):
+            payload += value.encode('utf-8') + b'\x00'
+        payload += struct.pack('<H', host_port)
+        payload += host_ip.encode('utf-8') + b'\x00'
+        return payload
+
+    @staticmethod
+    def _build_full_response(motd, version, max_players, host_ip, host_port):
+        payload = bytearray(b'\x00' + b'\x00' * 4)
+        payload += b'splitnum\x00\x80\x00'
+        fields = (
+            ('hostname', motd),
+            ('gametype', 'SMP'),
+            ('game_id', 'MINECRAFT'),
+            ('version', version),
+            ('plugins', ''),
+            ('map', 'world'),
+            ('numplayers', '0'),
+            ('maxplayers', str(max_players)),
+            ('hostport', str(host_port)),
+            ('hostip', host_ip),
+        )
+        for key, value in fields:
+            payload += key.encode('utf-8') + b'\x00' + value.encode('utf-8') + b'\x00'
+        payload += b'\x00'
+        # No players are ever online, so the player section is empty
+        payload += b'\x01player_\x00\x00'
+        payload += b'\x00'
+        return payload
+
+    def _rotate_secret(self, now):
+        elapsed = now - self._rotated_at
+        if elapsed < TOKEN_LIFETIME:
+            return
+
+        if elapsed >= 2 * TOKEN_LIFETIME:
+            # Idle for more than a full token lifetime, nothing issued
+            # before the gap may stay valid.
+            self._previous_secret = os.urandom(16)
+        else:
+            self._previous_secret = self._secret
+        self._secret = os.urandom(16)
+        self._rotated_at += (elapsed // TOKEN_LIFETIME) * TOKEN_LIFETIME
+
+    @staticmethod
+    def _token_for(secret, ip):
+        digest = hmac.new(secret, ip.encode('utf-8'), hashlib.sha256).digest()
+        return struct.unpack('>I', digest[:4])[0] & 0x7FFFFFFF
+
+    def _is_valid_token(self, token, ip):
+        return token in (self._token_for(self._secret, ip), self._token_for(self._previous_secret, ip))
+
+    def _take_allowance(self, now):
+        self._allowance = min(float(self.rate_limit), self._allowance + (now - self._last_refill) * self.rate_limit)
+        self._last_refill = now
+        if self._allowance < 1.0:
+            return False
+        self._allowance -= 1.0
+        return True
+
+    def handle_packet(self, data, addr):
+        """Return the response for a query packet, or None to stay silent"""
+        if len(data) < HANDSHAKE_REQUEST_LENGTH or data[:2] != MAGIC:
+            return None
+
+        now = time.monotonic()
+        self._rotate_secret(now)
+
+        packet_type = data[2]
+        session_id = bytes(data[3:7])
+
+        if packet_type == TYPE_HANDSHAKE and len(data) == HANDSHAKE_REQUEST_LENGTH:
+            if not self._take_allowance(now):
+                return None
+            token = self._token_for(self._secret, addr[0])
+            return b'\x09' + session_id + str(token).encode('ascii') + b'\x00'
+
+        if packet_type == TYPE_STAT and len(data) in (BASIC_STAT_REQUEST_LENGTH, FULL_STAT_REQUEST_LENGTH):
+            token = struct.unpack('>i', data[7:11])[0]
+            if not self._is_valid_token(token, addr[0]):
+                return None
+            if not self._take_allowance(now):
+                return None
+            response = self._full_response if len(data) == FULL_STAT_REQUEST_LENGTH else self._basic_response
+            response[1:5] = session_id
+            return response
+
+        return None
+
+    @property
+    def secrets(self):
+        """Current and previous token secrets, to hand to a new instance"""
+        return self._secret + self._previous_secret
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop answering queries without closing the socket.
+
+        Waits for the responder thread, which requires a poll_interval.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def serve_forever(self):
+        while not self._stopped.is_set():
+            try:
+                data, addr = self.sock.recvfrom(2048)
+            except socket.timeout:
+                continue
+            except ConnectionResetError:
+                # Windows reports ICMP port unreachable from a previous
+                # reply on the next recvfrom, the socket is still usable.
+                continue
+            except OSError as e:
+                if self.sock.fileno() == -1:
+                    break
+                print(f"[WARN] Query receive error: {e}")
+                continue
+
+            response = self.handle_packet(data, addr)
+            if response is None:
+                continue
+
+            try:
+                self.sock.sendto(response, addr)
+            except OSError as e:
+                print(f"[WARN] Failed to send query response to {addr[0]}:{addr[1]}: {e}")
+
+        print("[INFO] Query responder stopped")
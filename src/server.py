@@ -4,11 +4,14 @@ import json
 import struct
 import sys
 import os
+import time
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from config_loader import load_config
 from motd_centering import center_text_by_width, load_font_widths
+from query import QueryServer, create_query_socket
+from handoff import HANDOFF_SUPPORTED, HandoffError, HandoffListener, finish_request, request_sockets
 
 config = load_config()
 
@@ -22,6 +25,17 @@ CENTER_MOTD = [True if val == '1' else False for val in tuple(config.get('server
 PROTOCOL_VERSION = config.get('minecraft', {}).get('protocol_version', 47)
 MINECRAFT_VERSION = config.get('minecraft', {}).get('version', "Maintenance")
 
+QUERY_ENABLED = config.get('query', {}).get('enabled', False)
+QUERY_PORT = config.get('query', {}).get('port', PORT)
+QUERY_RATE_LIMIT = config.get('query', {}).get('rate_limit', 50)
+
+HANDOFF_REQUESTED = config.get('server', {}).get('handoff', {}).get('enabled', False)
+HANDOFF_ENABLED = HANDOFF_REQUESTED and HANDOFF_SUPPORTED
+HANDOFF_SOCKET = config.get('server', {}).get('handoff', {}).get('socket', 'mc-server-holder.sock')
+HANDOFF_DRAIN_TIMEOUT = config.get('server', {}).get('handoff', {}).get('drain_timeout', 30)
+
+ACCEPT_POLL_INTERVAL = 0.5
+
 FONT_WIDTHS = load_font_widths()
 
 def pack_varint(data):
@@ -64,6 +78,31 @@ def safe_recv(conn, size):
             break
     return data
 
+def build_motd():
+    motd_lines = SERVER_LIST_MESSAGE.split('\n')
+
+    if CENTER_MOTD[0] and len(motd_lines) > 0:
+        motd_lines[0] = center_text_by_width(motd_lines[0], FONT_WIDTHS)
+    if CENTER_MOTD[1] and len(motd_lines) > 1:
+        motd_lines[1] = center_text_by_width(motd_lines[1], FONT_WIDTHS)
+
+    return '\n'.join(motd_lines)
+
+def start_query_server(query_socket=None, secrets=None):
+    if query_socket is None:
+        try:
+            query_socket = create_query_socket(HOST, QUERY_PORT)
+        except OSError as e:
+            print(f"[ERROR] Query port {QUERY_PORT} may be already in use or another error occurred.")
+            print(e)
+            return None
+
+    poll_interval = ACCEPT_POLL_INTERVAL if HANDOFF_ENABLED else None
+    query_server = QueryServer(query_socket, build_motd(), MINECRAFT_VERSION, 0, HOST, PORT, QUERY_RATE_LIMIT, poll_interval, secrets)
+    query_server.start()
+    print(f"[OK] Query responder running on {HOST}:{QUERY_PORT} (UDP)")
+    return query_server
+
 def handle_client(conn, addr):
     addr_str = f"{addr[0]}:{addr[1]}" if isinstance(addr, tuple) else str(addr)
     print(f"[INFO] Connection from {addr_str}")
@@ -112,20 +151,10 @@ def handle_client(conn, addr):
                 print(f"[WARN] Error reading status request from {addr_str}: {e}")
                 return
 
-            final_motd = SERVER_LIST_MESSAGE
-            motd_lines = final_motd.split('\n')
-
-            if CENTER_MOTD[0] and len(motd_lines) > 0:
-                motd_lines[0] = center_text_by_width(motd_lines[0], FONT_WIDTHS)
-            if CENTER_MOTD[1] and len(motd_lines) > 1:
-                motd_lines[1] = center_text_by_width(motd_lines[1], FONT_WIDTHS)
-
-            final_motd = '\n'.join(motd_lines)
-
             response_json = {
                 "version": {"name": MINECRAFT_VERSION, "protocol": PROTOCOL_VERSION},
                 "players": {"max": 0, "online": 0, "sample": [""]},
-                "description": {"text": final_motd}
+                "description": {"text": build_motd()}
             }
 
             response_data = json.dumps(response_json).encode('utf-8')
@@ -209,20 +238,114 @@ def handle_client(conn, addr):
             pass
         print(f"[INFO] Connection with {addr_str} closed")
 
+def take_over_sockets():
+    try:
+        handoff_conn, fds, query_secrets = request_sockets(HANDOFF_SOCKET)
+    except (HandoffError, OSError) as e:
+        print(f"[WARN] Could not take over sockets from the running instance: {e}")
+        return None, None, None, None
+
+    if handoff_conn is None:
+        return None, None, None, None
+
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM, fileno=fds[0])
+    query_socket = None
+    if len(fds) > 1:
+        if QUERY_ENABLED:
+            query_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, fileno=fds[1])
+        else:
+            os.close(fds[1])
+
+    bound_port = server_socket.getsockname()[1]
+    print("[OK] Took over listening socket from the running instance")
+    if bound_port != PORT:
+        print(f"[WARN] Inherited socket is bound to port {bound_port}, not {PORT}. Restart without handoff to change ports.")
+    return handoff_conn, server_socket, query_socket, query_secrets
+
+def drain_clients(client_threads):
+    client_threads = [t for t in client_threads if t.is_alive()]
+    if not client_threads:
+        return
+
+    print(f"[INFO] Waiting for {len(client_threads)} connection(s) to finish...")
+    deadline = time.monotonic() + HANDOFF_DRAIN_TIMEOUT
+    for client_thread in client_threads:
+        client_thread.join(max(0.0, deadline - time.monotonic()))
+
+    remaining = sum(1 for t in client_threads if t.is_alive())
+    if remaining:
+        print(f"[WARN] {remaining} connection(s) still open after {HANDOFF_DRAIN_TIMEOUT}s, closing anyway")
+
 def main():
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket = None
+    query_socket = None
+    query_server = None
+    query_secrets = None
+    handoff_conn = None
+    handoff_listener = None
+    stop_accepting = threading.Event()
+    client_threads = []
+
+    def pause_query_server():
+        # Stop reading the shared query socket before handing it off, queued
+        # datagrams are answered by the new instance with the same secrets.
+        if query_server is None:
+            return b''
+        query_server.stop()
+        return query_server.secrets
+
+    def resume_query_server():
+        if query_server is not None:
+            query_server.start()
+
+    if HANDOFF_REQUESTED and not HANDOFF_SUPPORTED:
+        print("[WARN] Socket handoff is not supported on this platform, zero-downtime restart is disabled.")
+
     try:
-        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        server_socket.bind((HOST, PORT))
-        server_socket.listen(5)
+        if HANDOFF_ENABLED:
+            handoff_conn, server_socket, query_socket, query_secrets = take_over_sockets()
+
+        if server_socket is None:
+            server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server_socket.bind((HOST, PORT))
+            server_socket.listen(5)
+
+        if HANDOFF_ENABLED:
+            # Accept with a timeout so the loop can stop after a handoff. The
+            # other instance shares the socket and uses the same non-blocking mode.
+            server_socket.settimeout(ACCEPT_POLL_INTERVAL)
         print(f"[OK] MC Server Holder running on {HOST}:{PORT}")
+        if QUERY_ENABLED:
+            query_server = start_query_server(query_socket, query_secrets)
+            query_socket = query_server.sock if query_server is not None else None
+
+        if handoff_conn is not None:
+            finish_request(handoff_conn)
+
+        if HANDOFF_ENABLED:
+            try:
+                handoff_listener = HandoffListener(HANDOFF_SOCKET, [sock for sock in (server_socket, query_socket) if sock is not None], stop_accepting.set, pause_query_server, resume_query_server)
+                handoff_listener.start()
+            except OSError as e:
+                print(f"[WARN] Could not listen for socket handoff on {HANDOFF_SOCKET}: {e}")
+
         print("Waiting for connections... Press Ctrl+C to stop.")
 
-        while True:
-            conn, addr = server_socket.accept()
+        while not stop_accepting.is_set():
+            try:
+                conn, addr = server_socket.accept()
+            except socket.timeout:
+                continue
             client_thread = threading.Thread(target=handle_client, args=(conn, addr))
             client_thread.daemon = True
             client_thread.start()
+            client_threads = [t for t in client_threads if t.is_alive()]
+            client_threads.append(client_thread)
+
+        print("[INFO] Stopped accepting connections.")
+        server_socket.close()
+        drain_clients(client_threads)
 
     except OSError as e:
         print(f"[ERROR] Port {PORT} may be already in use or another error occurred.")
@@ -230,7 +353,12 @@ def main():
     except KeyboardInterrupt:
         print("\n[INFO] Server stopped.")
     finally:
-        server_socket.close()
+        if server_socket is not None:
+            server_socket.close()
+        if query_socket is not None:
+            query_socket.close()
+        if handoff_listener is not None:
+            handoff_listener.close()
 
 if __name__ == '__main__':
     main()